@@ -2,112 +2,87 @@
 Lambda function for AI-powered recipe generation using Amazon Bedrock.
 """
 
+import gzip
 import json
 import os
+import orjson
 import boto3
+import time
 import uuid
-from datetime import datetime
-from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from typing import Dict, Any, Optional, List, Tuple
 from aws_lambda_powertools import Logger, Tracer, Metrics
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.metrics import MetricUnit
 
+try:
+    from snapshot_restore_py import register_after_restore
+except ImportError:  # Only provided by the Lambda runtime
+    register_after_restore = None
+
+# Perf mode disables the tracer, so boto3 isn't patched for X-Ray, and drops the tracer and
+# metrics wrappers from the hot path; buffered metrics are then only emitted once the
+# powertools buffer fills up
+POWERTOOLS_PERF_MODE = os.environ.get('POWERTOOLS_PERF_MODE', 'false').lower() == 'true'
+
 # Initialize powertools
 logger = Logger()
-tracer = Tracer()
+tracer = Tracer(disabled=True) if POWERTOOLS_PERF_MODE else Tracer()
 metrics = Metrics()
 
-# Initialize AWS clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
-dynamodb = boto3.resource('dynamodb', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
 
-# Environment variables
-DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'recipe-ai-recipes')
-BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0')
+def _passthrough(func):
+    return func
 
-# DynamoDB table
-table = dynamodb.Table(DYNAMODB_TABLE_NAME)
 
+_capture_method = _passthrough if POWERTOOLS_PERF_MODE else tracer.capture_method
+_capture_lambda_handler = _passthrough if POWERTOOLS_PERF_MODE else tracer.capture_lambda_handler
+_log_metrics = _passthrough if POWERTOOLS_PERF_MODE else metrics.log_metrics
 
-class RecipeGenerator:
-    """Recipe generation using Amazon Bedrock."""
-    
-    def __init__(self):
-        self.model_id = BEDROCK_MODEL_ID
+# All AWS clients share one session and a pooled, keep-alive connection config
+_session = boto3.session.Session(region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+_CLIENT_CONFIG = Config(
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    connect_timeout=2,
+    read_timeout=30
+)
+
+# Initialize AWS clients; Bedrock is used on every request
+bedrock_runtime = _session.client('bedrock-runtime', config=_CLIENT_CONFIG)
+
+
+def _reset_bedrock_connections():
+    """Drop HTTPS connections captured in a SnapStart snapshot so they are reopened."""
     
-    @tracer.capture_method
-    def generate_recipe(self, ingredients: List[str], dietary_restrictions: List[str] = None,
-                       cuisine_type: str = None, meal_type: str = None, 
-                       difficulty: str = "medium") -> Dict[str, Any]:
-        """Generate a recipe using Amazon Bedrock."""
-        
-        # Build the prompt
-        prompt = self._build_prompt(ingredients, dietary_restrictions, cuisine_type, meal_type, difficulty)
-        
-        # Prepare the request body for Bedrock
-        request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 2000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-        
-        try:
-            # Call Bedrock
-            response = bedrock_runtime.invoke_model(
-                modelId=self.model_id,
-                contentType='application/json',
-                accept='application/json',
-                body=json.dumps(request_body)
-            )
-            
-            # Parse response
-            response_body = json.loads(response['body'].read())
-            generated_text = response_body['content'][0]['text']
-            
-            # Parse the generated recipe
-            recipe = self._parse_recipe_response(generated_text)
-            
-            metrics.add_metric(name="RecipeGenerated", unit=MetricUnit.Count, value=1)
-            
-            return recipe
-            
-        except Exception as e:
-            logger.error(f"Error generating recipe: {str(e)}")
-            metrics.add_metric(name="RecipeGenerationError", unit=MetricUnit.Count, value=1)
-            raise
-    
-    def _build_prompt(self, ingredients: List[str], dietary_restrictions: List[str] = None,
-                     cuisine_type: str = None, meal_type: str = None, 
-                     difficulty: str = "medium") -> str:
-        """Build the prompt for recipe generation."""
-        
-        ingredients_str = ", ".join(ingredients)
-        
-        prompt = f"""Generate a detailed recipe using the following ingredients: {ingredients_str}
+    bedrock_runtime._endpoint.http_session.close()
 
-Requirements:
-- Difficulty level: {difficulty}
-"""
-        
-        if dietary_restrictions:
-            restrictions_str = ", ".join(dietary_restrictions)
-            prompt += f"- Dietary restrictions: {restrictions_str}\n"
-        
-        if cuisine_type:
-            prompt += f"- Cuisine type: {cuisine_type}\n"
-        
-        if meal_type:
-            prompt += f"- Meal type: {meal_type}\n"
-        
-        prompt += """
+
+if register_after_restore is not None:
+    register_after_restore(_reset_bedrock_connections)
+
+# Persistence clients are created on first use, so requests that don't save skip their init
+_dynamodb_client = None
+_sqs_client = None
+_lambda_client = None
+_type_serializer = TypeSerializer()
+
+# Environment variables
+DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'recipe-ai-recipes')
+BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'us.anthropic.claude-3-5-haiku-20241022-v1:0')
+RECIPE_SAVE_QUEUE_URL = os.environ.get('RECIPE_SAVE_QUEUE_URL')
+BEDROCK_LATENCY_OPTIMIZED = os.environ.get('BEDROCK_LATENCY_OPTIMIZED', 'true').lower() == 'true'
+
+# Static prompt fragments, built once per container
+_PROMPT_JSON_SCHEMA_TAIL = """
 Please provide the recipe in the following JSON format:
 {
     "title": "Recipe Name",
@@ -141,125 +116,538 @@ Please provide the recipe in the following JSON format:
 
 Please ensure all ingredients from the input list are used in the recipe where possible.
 """
+
+# Prompt with only the per-request fields left to fill in; the schema braces are escaped for format_map
+_PROMPT_TEMPLATE = (
+    "Generate a detailed recipe using the following ingredients: {ingredients}\n\n"
+    "Requirements:\n"
+    "- Difficulty level: {difficulty}\n"
+    "{options}"
+    + _PROMPT_JSON_SCHEMA_TAIL.replace('{', '{{').replace('}', '}}')
+)
+
+# Bedrock request fields that do not vary between invocations
+_BASE_REQUEST_BODY = {
+    "anthropic_version": "bedrock-2023-05-31",
+    "temperature": 0.7,
+    "top_p": 0.9
+}
+
+# Response headers shared by every API Gateway response
+_CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'POST,OPTIONS'
+}
+
+# Output token budget: the default fits a complete recipe in the prompt's schema, and is
+# only a cap, so shorter recipes don't pay for it; callers may raise it up to the limit
+_DEFAULT_MAX_TOKENS = 2000
+_MAX_TOKENS_LIMIT = 4096
+
+# Bounds on the request fields that reach the prompt, keeping prompts to a sensible size;
+# these match the RecipeRequest model API Gateway validates against
+_MAX_INGREDIENTS = 10
+_MAX_INGREDIENT_LENGTH = 100
+_MAX_DIETARY_RESTRICTIONS = 10
+_MAX_OPTION_LENGTH = 50
+
+# Source of recipes built from unparseable model output; these are never cached
+_FALLBACK_SOURCE = 'ai_fallback'
+
+# In-container LRU of encoded recipes, keyed on the normalized request inputs
+_RECIPE_CACHE_SIZE = 128
+_recipe_cache: "OrderedDict[tuple, Tuple[bytes, Dict[str, Any]]]" = OrderedDict()
+
+# Shared decoder for extracting the recipe object from model output
+_JSON_DECODER = json.JSONDecoder()
+
+# BatchWriteItem accepts at most 25 put requests per call
+_BATCH_WRITE_SIZE = 25
+_BATCH_WRITE_MAX_ATTEMPTS = 5
+
+# How long a fanned-out warmer ping keeps its environment busy, so the concurrent
+# pings can't be served by each other's environments
+_WARMER_HOLD_MS = 100
+
+# Free-text recipe fields stored gzipped in the compressed_body attribute
+_COMPRESSED_FIELDS = ('instructions', 'tips')
+
+# Marshalled recipes waiting to be persisted with BatchWriteItem, paired with a
+# caller-chosen key (e.g. the SQS message id) used to report failed writes
+_pending_writes: List[Tuple[str, Dict[str, Any]]] = []
+
+# Latency-optimized inference is only available for some models/regions
+_PERFORMANCE_CONFIG_LATENCY = 'optimized' if BEDROCK_LATENCY_OPTIMIZED else 'standard'
+
+
+class RecipeTruncatedError(Exception):
+    """Raised when a completion stops at its max_tokens budget before the recipe is complete."""
+    
+    def __init__(self, max_tokens: int):
+        super().__init__(f"Recipe generation stopped at the max_tokens limit of {max_tokens}")
+        self.max_tokens = max_tokens
+
+
+@_capture_method
+def generate_recipe(ingredients: List[str], dietary_restrictions: List[str] = None,
+                    cuisine_type: str = None, meal_type: str = None,
+                    difficulty: str = "medium", max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """Generate a recipe using Amazon Bedrock."""
+    
+    # Build the prompt
+    prompt = _build_prompt(ingredients, dietary_restrictions, cuisine_type, meal_type, difficulty)
+    
+    if max_tokens is None:
+        max_tokens = _DEFAULT_MAX_TOKENS
+    
+    try:
+        # A single call at the full budget; a retry could outrun the Lambda and API Gateway timeouts
+        generated_text, stop_reason = _stream_completion(prompt, max_tokens)
+        
+        # A truncated completion can't be parsed into a recipe
+        if stop_reason == 'max_tokens':
+            metrics.add_metric(name="RecipeTruncated", unit=MetricUnit.Count, value=1)
+            raise RecipeTruncatedError(max_tokens)
+        
+        # Parse the generated recipe
+        recipe = _parse_recipe_response(generated_text)
+        
+        metrics.add_metric(name="RecipeGenerated", unit=MetricUnit.Count, value=1)
+        
+        return recipe
+        
+    except Exception as e:
+        logger.error(f"Error generating recipe: {str(e)}")
+        metrics.add_metric(name="RecipeGenerationError", unit=MetricUnit.Count, value=1)
+        raise
+
+
+def _stream_completion(prompt: str, max_tokens: int) -> Tuple[str, Optional[str]]:
+    """Stream a completion from Bedrock, returning its text and stop reason."""
+    
+    request_body = {
+        **_BASE_REQUEST_BODY,
+        "max_tokens": max_tokens,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    }
+    
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=BEDROCK_MODEL_ID,
+        contentType='application/json',
+        accept='application/json',
+        body=orjson.dumps(request_body),
+        performanceConfigLatency=_PERFORMANCE_CONFIG_LATENCY
+    )
+    
+    # Accumulate text deltas and join once at the end of the stream
+    text_parts = []
+    stop_reason = None
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        
+        payload = orjson.loads(chunk['bytes'])
+        if payload.get('type') == 'content_block_delta':
+            text_parts.append(payload['delta'].get('text', ''))
+        elif payload.get('type') == 'message_delta':
+            stop_reason = payload['delta'].get('stop_reason')
+    
+    return "".join(text_parts), stop_reason
+
+
+def _build_prompt(ingredients: List[str], dietary_restrictions: List[str] = None,
+                  cuisine_type: str = None, meal_type: str = None,
+                  difficulty: str = "medium") -> str:
+    """Build the prompt for recipe generation."""
+    
+    # Collect only the optional requirement lines that apply, then join them once
+    options = []
+    if dietary_restrictions:
+        options.append(f"- Dietary restrictions: {', '.join(dietary_restrictions)}")
+    if cuisine_type:
+        options.append(f"- Cuisine type: {cuisine_type}")
+    if meal_type:
+        options.append(f"- Meal type: {meal_type}")
+    
+    return _PROMPT_TEMPLATE.format_map({
+        'ingredients': ", ".join(ingredients),
+        'difficulty': difficulty,
+        'options': "\n".join(options) + "\n" if options else ""
+    })
+
+
+def _parse_recipe_response(response_text: str) -> Dict[str, Any]:
+    """Parse the AI response into a structured recipe."""
+    
+    try:
+        # Decode the first JSON object in the response, ignoring any trailing text
+        start_idx = response_text.find('{')
+        
+        if start_idx == -1:
+            raise ValueError("No JSON found in response")
+        
+        recipe, _ = _JSON_DECODER.raw_decode(response_text, start_idx)
+        
+        # Add metadata; id and created_at are stamped per response by the handler
+        recipe['source'] = 'ai_generated'
         
-        return prompt
+        return recipe
+        
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse recipe JSON: {str(e)}")
+        # Return a fallback recipe structure
+        return _create_fallback_recipe(response_text)
+    except Exception as e:
+        logger.error(f"Error parsing recipe response: {str(e)}")
+        raise
+
+
+def _create_fallback_recipe(response_text: str) -> Dict[str, Any]:
+    """Create a fallback recipe structure when JSON parsing fails."""
+    
+    return {
+        'title': 'AI Generated Recipe',
+        'description': 'Recipe generated by AI',
+        'prep_time': '20 minutes',
+        'cook_time': '30 minutes',
+        'total_time': '50 minutes',
+        'servings': 4,
+        'difficulty': 'medium',
+        'cuisine': 'various',
+        'ingredients': [],
+        'instructions': [response_text],
+        'nutrition': {},
+        'tags': ['ai-generated'],
+        'tips': [],
+        'source': _FALLBACK_SOURCE
+    }
+
+
+def _generate_cached(cache_key: tuple, **kwargs) -> Tuple[bytes, Dict[str, Any]]:
+    """Return a recipe's JSON encoding and dict, reusing cached ones for an identical request.
+    
+    The prompt is built from kwargs as the caller sent them; cache_key is only their
+    normalized form. Both forms omit id and created_at, which are added per response, and
+    the dict is shared between requests so must not be mutated. Fallback recipes are not
+    cached, so a retry can still get a parsed one.
+    """
+    
+    cached = _recipe_cache.get(cache_key)
+    if cached is not None:
+        _recipe_cache.move_to_end(cache_key)
+        return cached
+    
+    recipe = generate_recipe(**kwargs)
+    try:
+        recipe_json = orjson.dumps(recipe)
+    except orjson.JSONEncodeError as e:
+        # orjson rejects integers wider than 64 bits, which the stdlib decoder accepts
+        logger.error(f"Failed to encode recipe: {str(e)}")
+        recipe = _create_fallback_recipe(json.dumps(recipe))
+        recipe_json = orjson.dumps(recipe)
+    result = (recipe_json, recipe)
     
-    def _parse_recipe_response(self, response_text: str) -> Dict[str, Any]:
-        """Parse the AI response into a structured recipe."""
+    if recipe.get('source') != _FALLBACK_SOURCE:
+        _recipe_cache[cache_key] = result
+        if len(_recipe_cache) > _RECIPE_CACHE_SIZE:
+            _recipe_cache.popitem(last=False)
+    
+    return result
+
+
+def _stamp_recipe(recipe_json: bytes, recipe_id: str, created_at: str) -> bytes:
+    """Append id and created_at to an encoded, non-empty recipe object without re-serializing it."""
+    
+    return recipe_json[:-1] + f',"id":"{recipe_id}","created_at":"{created_at}"}}'.encode()
+
+
+def _get_ddb():
+    """Return the low-level DynamoDB client, creating it on first use."""
+    
+    global _dynamodb_client
+    if _dynamodb_client is None:
+        _dynamodb_client = _session.client('dynamodb', config=_CLIENT_CONFIG)
+    return _dynamodb_client
+
+
+def _get_sqs():
+    """Return the SQS client, creating it on first use."""
+    
+    global _sqs_client
+    if _sqs_client is None:
+        _sqs_client = _session.client('sqs', config=_CLIENT_CONFIG)
+    return _sqs_client
+
+
+def _get_lambda():
+    """Return the Lambda client used by the warmer, creating it on first use."""
+    
+    global _lambda_client
+    if _lambda_client is None:
+        _lambda_client = _session.client('lambda', config=_CLIENT_CONFIG)
+    return _lambda_client
+
+
+def _to_item(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """Marshal a recipe into the DynamoDB attribute-value format.
+    
+    The bulky free-text fields are gzipped into a single binary attribute; searchable
+    fields such as tags, cuisine and difficulty stay top-level. compressed_body holds the
+    gzip of an orjson-encoded object {"instructions": [...], "tips": [...]}, with either
+    list empty when the recipe lacks it, so readers recover the fields with
+    orjson.loads(gzip.decompress(item['compressed_body'])).
+    """
+    
+    item = {key: value for key, value in recipe.items() if key not in _COMPRESSED_FIELDS}
+    item['compressed_body'] = gzip.compress(
+        orjson.dumps({field: recipe.get(field, []) for field in _COMPRESSED_FIELDS})
+    )
+    return {key: _type_serializer.serialize(_floats_to_decimal(value)) for key, value in item.items()}
+
+
+def _floats_to_decimal(value: Any) -> Any:
+    """Replace floats, which DynamoDB rejects, with Decimals throughout a value."""
+    
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {key: _floats_to_decimal(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_floats_to_decimal(item) for item in value]
+    return value
+
+
+@_capture_method
+def _flush() -> List[str]:
+    """Persist all pending items using BatchWriteItem, retrying unprocessed items.
+    
+    Returns the keys of the items that could not be written.
+    """
+    
+    pending = _pending_writes[:]
+    _pending_writes.clear()
+    failed = []
+    
+    for start in range(0, len(pending), _BATCH_WRITE_SIZE):
+        chunk = pending[start:start + _BATCH_WRITE_SIZE]
+        keys_by_id = {item['id']['S']: key for key, item in chunk}
+        request_items = {DYNAMODB_TABLE_NAME: [{'PutRequest': {'Item': item}} for _, item in chunk]}
         
         try:
-            # Find JSON in the response
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            
-            if start_idx == -1 or end_idx == 0:
-                raise ValueError("No JSON found in response")
-            
-            json_str = response_text[start_idx:end_idx]
-            recipe = json.loads(json_str)
-            
-            # Add metadata
-            recipe['id'] = str(uuid.uuid4())
-            recipe['created_at'] = datetime.utcnow().isoformat()
-            recipe['source'] = 'ai_generated'
-            
-            return recipe
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse recipe JSON: {str(e)}")
-            # Return a fallback recipe structure
-            return self._create_fallback_recipe(response_text)
-        except Exception as e:
-            logger.error(f"Error parsing recipe response: {str(e)}")
-            raise
-    
-    def _create_fallback_recipe(self, response_text: str) -> Dict[str, Any]:
-        """Create a fallback recipe structure when JSON parsing fails."""
+            for attempt in range(_BATCH_WRITE_MAX_ATTEMPTS):
+                response = _get_ddb().batch_write_item(RequestItems=request_items)
+                request_items = response.get('UnprocessedItems')
+                if not request_items:
+                    break
+                
+                # Exponential backoff before retrying throttled items
+                time.sleep(0.05 * (2 ** attempt))
+        except (ClientError, BotoCoreError) as e:
+            # One invalid item rejects the whole request, so write the chunk item by item to isolate it
+            logger.warning(f"BatchWriteItem failed, retrying items individually: {str(e)}")
+            failed.extend(_put_items(chunk))
+            continue
         
-        return {
-            'id': str(uuid.uuid4()),
-            'title': 'AI Generated Recipe',
-            'description': 'Recipe generated by AI',
-            'prep_time': '20 minutes',
-            'cook_time': '30 minutes',
-            'total_time': '50 minutes',
-            'servings': 4,
-            'difficulty': 'medium',
-            'cuisine': 'various',
-            'ingredients': [],
-            'instructions': [response_text],
-            'nutrition': {},
-            'tags': ['ai-generated'],
-            'tips': [],
-            'created_at': datetime.utcnow().isoformat(),
-            'source': 'ai_generated'
-        }
+        if request_items:
+            unprocessed = request_items.get(DYNAMODB_TABLE_NAME, [])
+            logger.error(f"{len(unprocessed)} recipes left unprocessed after {_BATCH_WRITE_MAX_ATTEMPTS} attempts")
+            failed.extend(keys_by_id[request['PutRequest']['Item']['id']['S']] for request in unprocessed)
+    
+    return failed
+
+
+def _put_items(items: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+    """Write items one at a time with put_item, returning the keys of those that failed."""
+    
+    failed = []
+    for key, item in items:
+        try:
+            _get_ddb().put_item(TableName=DYNAMODB_TABLE_NAME, Item=item)
+        except (ClientError, BotoCoreError) as e:
+            logger.error(f"Failed to save recipe {key} to DynamoDB: {str(e)}")
+            failed.append(key)
+    return failed
+
+
+def _get_field(body: Dict[str, Any], name: str, default: Any) -> Any:
+    """Return a request body field, treating an explicit null the same as a missing field."""
+    
+    value = body.get(name)
+    return default if value is None else value
 
 
-@tracer.capture_lambda_handler
+def _is_short_string(value: Any) -> bool:
+    """Whether a request option is a string short enough to put in the prompt."""
+    
+    return isinstance(value, str) and len(value) <= _MAX_OPTION_LENGTH
+
+
+def _handle_warmer(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
+    """Keep execution environments warm, fanning out to keep several instances alive.
+    
+    The fan-out pings are synchronous and sent concurrently, and each holds its environment
+    for _WARMER_HOLD_MS, so every ping needs an environment of its own.
+    """
+    
+    concurrency = int(event.get('concurrency', 1))
+    if concurrency > 1:
+        lambda_client = _get_lambda()
+        payload = orjson.dumps({'source': 'warmer', 'concurrency': 1, 'hold_ms': _WARMER_HOLD_MS})
+        
+        def ping(_):
+            return lambda_client.invoke(
+                FunctionName=context.invoked_function_arn,
+                InvocationType='RequestResponse',
+                Payload=payload
+            )
+        
+        with ThreadPoolExecutor(max_workers=concurrency - 1) as executor:
+            list(executor.map(ping, range(concurrency - 1)))
+    
+    hold_ms = event.get('hold_ms')
+    if hold_ms:
+        time.sleep(hold_ms / 1000)
+    
+    return {'statusCode': 200, 'body': 'warm'}
+
+
+@_capture_lambda_handler
 @logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
-@metrics.log_metrics
+@_log_metrics
 def lambda_handler(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
     """Lambda handler for recipe generation."""
     
+    # Scheduled keep-warm pings return before touching Bedrock or DynamoDB
+    if event.get('source') == 'warmer':
+        return _handle_warmer(event, context)
+    
     try:
         # Parse request body
-        body = json.loads(event.get('body', '{}'))
+        body = orjson.loads(event.get('body') or '{}')
         
-        # Extract parameters
-        ingredients = body.get('ingredients', [])
-        dietary_restrictions = body.get('dietary_restrictions', [])
+        # Extract parameters; a null field takes its default, as if it were omitted
+        ingredients = _get_field(body, 'ingredients', [])
+        dietary_restrictions = _get_field(body, 'dietary_restrictions', [])
         cuisine_type = body.get('cuisine_type')
         meal_type = body.get('meal_type')
-        difficulty = body.get('difficulty', 'medium')
-        save_to_db = body.get('save_to_db', True)
+        difficulty = _get_field(body, 'difficulty', 'medium')
+        save_to_db = _get_field(body, 'save_to_db', True)
+        max_tokens = body.get('max_tokens')
         
         # Validate inputs
         if not ingredients:
             return {
                 'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'POST,OPTIONS'
-                },
-                'body': json.dumps({
+                'headers': _CORS_HEADERS,
+                'body': orjson.dumps({
                     'error': 'Ingredients list is required'
-                })
+                }).decode()
+            }
+        
+        if (not isinstance(ingredients, list) or len(ingredients) > _MAX_INGREDIENTS
+                or any(not isinstance(i, str) or len(i) > _MAX_INGREDIENT_LENGTH for i in ingredients)):
+            return {
+                'statusCode': 400,
+                'headers': _CORS_HEADERS,
+                'body': orjson.dumps({
+                    'error': f'Ingredients must be a list of at most {_MAX_INGREDIENTS} names '
+                             f'of at most {_MAX_INGREDIENT_LENGTH} characters each'
+                }).decode()
+            }
+        
+        if (not isinstance(dietary_restrictions, list) or len(dietary_restrictions) > _MAX_DIETARY_RESTRICTIONS
+                or any(not _is_short_string(r) for r in dietary_restrictions)
+                or any(v is not None and not _is_short_string(v) for v in (cuisine_type, meal_type))
+                or not _is_short_string(difficulty)):
+            return {
+                'statusCode': 400,
+                'headers': _CORS_HEADERS,
+                'body': orjson.dumps({
+                    'error': f'dietary_restrictions must be a list of at most {_MAX_DIETARY_RESTRICTIONS} '
+                             'strings; cuisine_type, meal_type and difficulty must be strings; '
+                             f'each string must be at most {_MAX_OPTION_LENGTH} characters'
+                }).decode()
+            }
+        
+        # Drop duplicate ingredients, keeping their original order
+        ingredients = list(dict.fromkeys(ingredients))
+        
+        if max_tokens is not None and (type(max_tokens) is not int or not 1 <= max_tokens <= _MAX_TOKENS_LIMIT):
+            return {
+                'statusCode': 400,
+                'headers': _CORS_HEADERS,
+                'body': orjson.dumps({
+                    'error': f'max_tokens must be an integer between 1 and {_MAX_TOKENS_LIMIT}'
+                }).decode()
             }
         
         logger.info(f"Generating recipe with ingredients: {ingredients}")
         
-        # Generate recipe
-        generator = RecipeGenerator()
-        recipe = generator.generate_recipe(
+        # Generate recipe, reusing a cached result for identical requests
+        recipe_json, recipe = _generate_cached(
+            (
+                tuple(sorted(ingredients)),
+                tuple(sorted(dietary_restrictions)),
+                cuisine_type,
+                meal_type,
+                difficulty,
+                max_tokens
+            ),
             ingredients=ingredients,
             dietary_restrictions=dietary_restrictions,
             cuisine_type=cuisine_type,
             meal_type=meal_type,
-            difficulty=difficulty
+            difficulty=difficulty,
+            max_tokens=max_tokens
         )
         
+        # Every response gets its own identity, even when served from the cache
+        recipe_id = uuid.uuid4().hex
+        created_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        recipe_json = _stamp_recipe(recipe_json, recipe_id, created_at).decode()
+        
         # Save to DynamoDB if requested
         if save_to_db:
             try:
-                table.put_item(Item=recipe)
-                logger.info(f"Recipe saved to DynamoDB with ID: {recipe['id']}")
-                metrics.add_metric(name="RecipeSaved", unit=MetricUnit.Count, value=1)
+                if RECIPE_SAVE_QUEUE_URL:
+                    # Hand off to batch_save_handler, which writes with BatchWriteItem
+                    _get_sqs().send_message(QueueUrl=RECIPE_SAVE_QUEUE_URL, MessageBody=recipe_json)
+                    logger.info(f"Recipe queued for saving with ID: {recipe_id}")
+                    metrics.add_metric(name="RecipeQueued", unit=MetricUnit.Count, value=1)
+                else:
+                    item = _to_item({**recipe, 'id': recipe_id, 'created_at': created_at})
+                    _get_ddb().put_item(TableName=DYNAMODB_TABLE_NAME, Item=item)
+                    logger.info(f"Recipe saved to DynamoDB with ID: {recipe_id}")
+                    metrics.add_metric(name="RecipeSaved", unit=MetricUnit.Count, value=1)
             except Exception as e:
                 logger.error(f"Failed to save recipe to DynamoDB: {str(e)}")
                 # Don't fail the request if DB save fails
         
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'POST,OPTIONS'
-            },
-            'body': json.dumps(recipe)
+            'headers': _CORS_HEADERS,
+            'body': recipe_json
+        }
+        
+    except RecipeTruncatedError as e:
+        # The request's budget was too small for the recipe, which the caller can fix
+        logger.warning(str(e))
+        
+        return {
+            'statusCode': 422,
+            'headers': _CORS_HEADERS,
+            'body': orjson.dumps({
+                'error': f'The recipe did not fit in the max_tokens budget of {e.max_tokens}; '
+                         f'max_tokens may be raised to at most {_MAX_TOKENS_LIMIT}'
+            }).decode()
         }
         
     except Exception as e:
@@ -268,13 +656,41 @@ def lambda_handler(event: Dict[str, Any], context: LambdaContext) -> Dict[str, A
         
         return {
             'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'POST,OPTIONS'
-            },
-            'body': json.dumps({
+            'headers': _CORS_HEADERS,
+            'body': orjson.dumps({
                 'error': 'Internal server error'
-            })
+            }).decode()
         }
+
+
+@_capture_lambda_handler
+@logger.inject_lambda_context
+@_log_metrics
+def batch_save_handler(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
+    """Lambda handler persisting recipes delivered in batch events (e.g. SQS).
+    
+    Failed records are reported individually as batchItemFailures so only they are retried.
+    """
+    
+    records = event.get('Records', [])
+    failed = []
+    
+    for record in records:
+        try:
+            recipe = orjson.loads(record['body'])
+            if not isinstance(recipe.get('id'), str):
+                raise ValueError("Recipe has no id")
+            _pending_writes.append((record['messageId'], _to_item(recipe)))
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Skipping malformed recipe record {record['messageId']}: {str(e)}")
+            failed.append(record['messageId'])
+    
+    failed.extend(_flush())
+    
+    saved = len(records) - len(failed)
+    logger.info(f"Saved {saved} recipes to DynamoDB, {len(failed)} failed")
+    metrics.add_metric(name="RecipeSaved", unit=MetricUnit.Count, value=saved)
+    if failed:
+        metrics.add_metric(name="RecipeSaveError", unit=MetricUnit.Count, value=len(failed))
+    
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
@@ -25,8 +25,13 @@ provider "aws" {
   }
 }
 
+data "aws_caller_identity" "current" {}
+
 locals {
   function_name = "${var.environment}-recipe-generator"
+
+  # Cross-region inference profile IDs carry a geo prefix (e.g. "us.")
+  bedrock_foundation_model = replace(var.bedrock_model_id, "/^(us|eu|apac)\\./", "")
   
   common_tags = {
     Project     = "serverless-recipe-ai"
@@ -63,6 +68,29 @@ resource "aws_dynamodb_table" "recipe_cache" {
   tags = local.common_tags
 }
 
+# DynamoDB table for generated recipes, keyed on the recipe id
+resource "aws_dynamodb_table" "recipes" {
+  name           = "${var.environment}-recipes"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "id"
+  stream_enabled = false
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  point_in_time_recovery {
+    enabled = var.environment == "prod"
+  }
+
+  server_side_encryption {
+    enabled = true
+  }
+
+  tags = local.common_tags
+}
+
 # IAM role for Lambda function
 resource "aws_iam_role" "lambda_role" {
   name = "${local.function_name}-role"
@@ -105,17 +133,108 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Action = [
           "dynamodb:GetItem",
           "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem",
           "dynamodb:UpdateItem",
           "dynamodb:DeleteItem"
         ]
-        Resource = aws_dynamodb_table.recipe_cache.arn
+        Resource = [
+          aws_dynamodb_table.recipe_cache.arn,
+          aws_dynamodb_table.recipes.arn
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage"
+        ]
+        Resource = aws_sqs_queue.recipe_saves.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        Resource = [
+          "arn:aws:lambda:${var.aws_region}:${data.aws_caller_identity.current.account_id}:function:${local.function_name}",
+          "arn:aws:lambda:${var.aws_region}:${data.aws_caller_identity.current.account_id}:function:${local.function_name}:*"
+        ]
       },
       {
         Effect = "Allow"
         Action = [
-          "bedrock:InvokeModel"
+          "bedrock:InvokeModel",
+          "bedrock:InvokeModelWithResponseStream"
+        ]
+        Resource = [
+          "arn:aws:bedrock:*::foundation-model/${local.bedrock_foundation_model}",
+          "arn:aws:bedrock:${var.aws_region}:${data.aws_caller_identity.current.account_id}:inference-profile/${var.bedrock_model_id}"
         ]
-        Resource = "arn:aws:bedrock:${var.aws_region}::foundation-model/anthropic.claude-3-sonnet-20240229-v1:0"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "xray:PutTraceSegments",
+          "xray:PutTelemetryRecords"
+        ]
+        Resource = "*"
+      }
+    ]
+  })
+}
+
+# IAM role for the recipe saver, which only drains the save queue into the recipes table
+resource "aws_iam_role" "saver_role" {
+  name = "${local.function_name}-saver-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+
+  tags = local.common_tags
+}
+
+# IAM policy for the recipe saver
+resource "aws_iam_role_policy" "saver_policy" {
+  name = "${local.function_name}-saver-policy"
+  role = aws_iam_role.saver_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:${var.aws_region}:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem"
+        ]
+        Resource = aws_dynamodb_table.recipes.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Resource = aws_sqs_queue.recipe_saves.arn
       },
       {
         Effect = "Allow"
@@ -151,15 +270,23 @@ resource "aws_lambda_function" "recipe_generator" {
   role            = aws_iam_role.lambda_role.arn
   handler         = "generate-recipe.lambda_function.lambda_handler"
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
-  runtime         = "python3.11"
+  runtime         = "python3.12"
   timeout         = 30
   memory_size     = 512
+  publish         = true
+
+  # Restore from a snapshot of the initialized module instead of re-running init
+  snap_start {
+    apply_on = "PublishedVersions"
+  }
 
   environment {
     variables = {
-      DYNAMODB_TABLE = aws_dynamodb_table.recipe_cache.name
-      ENVIRONMENT    = var.environment
-      BEDROCK_MODEL  = "anthropic.claude-3-sonnet-20240229-v1:0"
+      DYNAMODB_TABLE_NAME       = aws_dynamodb_table.recipes.name
+      RECIPE_SAVE_QUEUE_URL     = aws_sqs_queue.recipe_saves.url
+      ENVIRONMENT               = var.environment
+      BEDROCK_MODEL_ID          = var.bedrock_model_id
+      BEDROCK_LATENCY_OPTIMIZED = tostring(var.bedrock_latency_optimized)
     }
   }
 
@@ -175,6 +302,107 @@ resource "aws_lambda_function" "recipe_generator" {
   tags = local.common_tags
 }
 
+# Alias tracking the latest published (SnapStart) version
+resource "aws_lambda_alias" "recipe_generator_live" {
+  name             = "live"
+  function_name    = aws_lambda_function.recipe_generator.function_name
+  function_version = aws_lambda_function.recipe_generator.version
+}
+
+# Scheduled ping keeping the generator's execution environments warm
+resource "aws_cloudwatch_event_rule" "warmer" {
+  name                = "${local.function_name}-warmer"
+  description         = "Keep ${local.function_name} warm"
+  schedule_expression = "rate(5 minutes)"
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "warmer" {
+  rule  = aws_cloudwatch_event_rule.warmer.name
+  arn   = aws_lambda_alias.recipe_generator_live.arn
+  input = jsonencode({
+    source      = "warmer"
+    concurrency = var.warmer_concurrency
+  })
+}
+
+resource "aws_lambda_permission" "warmer" {
+  statement_id  = "AllowExecutionFromEventBridgeWarmer"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.recipe_generator.function_name
+  qualifier     = aws_lambda_alias.recipe_generator_live.name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.warmer.arn
+}
+
+# SQS queue taking recipe persistence off the request path
+resource "aws_sqs_queue" "recipe_saves" {
+  name                       = "${var.environment}-recipe-saves"
+  visibility_timeout_seconds = 180
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.recipe_saves_dlq.arn
+    maxReceiveCount     = 5
+  })
+
+  tags = local.common_tags
+}
+
+# Dead-letter queue for recipes that repeatedly fail to save
+resource "aws_sqs_queue" "recipe_saves_dlq" {
+  name                      = "${var.environment}-recipe-saves-dlq"
+  message_retention_seconds = 1209600
+
+  tags = local.common_tags
+}
+
+# CloudWatch Log Group for the recipe saver
+resource "aws_cloudwatch_log_group" "saver_logs" {
+  name              = "/aws/lambda/${local.function_name}-saver"
+  retention_in_days = var.environment == "prod" ? 30 : 7
+
+  tags = local.common_tags
+}
+
+# Lambda function draining the save queue with BatchWriteItem
+resource "aws_lambda_function" "recipe_saver" {
+  filename         = data.archive_file.lambda_zip.output_path
+  function_name    = "${local.function_name}-saver"
+  role            = aws_iam_role.saver_role.arn
+  handler         = "generate-recipe.lambda_function.batch_save_handler"
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+  runtime         = "python3.12"
+  timeout         = 30
+  memory_size     = 256
+
+  environment {
+    variables = {
+      DYNAMODB_TABLE_NAME = aws_dynamodb_table.recipes.name
+      ENVIRONMENT         = var.environment
+    }
+  }
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  depends_on = [
+    aws_iam_role_policy.saver_policy,
+    aws_cloudwatch_log_group.saver_logs
+  ]
+
+  tags = local.common_tags
+}
+
+resource "aws_lambda_event_source_mapping" "recipe_saves" {
+  event_source_arn                   = aws_sqs_queue.recipe_saves.arn
+  function_name                      = aws_lambda_function.recipe_saver.arn
+  batch_size                         = 25
+  maximum_batching_window_in_seconds = 5
+  function_response_types            = ["ReportBatchItemFailures"]
+}
+
 # API Gateway
 resource "aws_api_gateway_rest_api" "recipe_api" {
   name        = "${var.environment}-recipe-api"
@@ -226,10 +454,13 @@ resource "aws_api_gateway_model" "recipe_request" {
     type = "object"
     required = ["ingredients"]
     properties = {
+      # Bounds match _MAX_INGREDIENTS, _MAX_INGREDIENT_LENGTH, _MAX_DIETARY_RESTRICTIONS and
+      # _MAX_OPTION_LENGTH in the generate-recipe handler; null fields take their defaults
       ingredients = {
         type = "array"
         items = {
-          type = "string"
+          type      = "string"
+          maxLength = 100
         }
         minItems = 1
         maxItems = 10
@@ -238,12 +469,25 @@ resource "aws_api_gateway_model" "recipe_request" {
         type = "string"
         enum = ["italian", "mexican", "indian", "chinese", "japanese", "french", "american", "mediterranean"]
       }
+      cuisine_type = {
+        type      = ["string", "null"]
+        maxLength = 50
+      }
+      meal_type = {
+        type      = ["string", "null"]
+        maxLength = 50
+      }
+      difficulty = {
+        type      = ["string", "null"]
+        maxLength = 50
+      }
       dietary_restrictions = {
-        type = "array"
+        type = ["array", "null"]
         items = {
           type = "string"
           enum = ["vegetarian", "vegan", "gluten-free", "dairy-free", "keto", "paleo"]
         }
+        maxItems = 10
       }
       serving_size = {
         type = "integer"
@@ -262,7 +506,7 @@ resource "aws_api_gateway_integration" "recipes_post" {
 
   integration_http_method = "POST"
   type                   = "AWS_PROXY"
-  uri                    = aws_lambda_function.recipe_generator.invoke_arn
+  uri                    = aws_lambda_alias.recipe_generator_live.invoke_arn
 }
 
 # Lambda permission for API Gateway
@@ -270,6 +514,7 @@ resource "aws_lambda_permission" "api_gateway" {
   statement_id  = "AllowExecutionFromAPIGateway"
   action        = "lambda:InvokeFunction"
   function_name = aws_lambda_function.recipe_generator.function_name
+  qualifier     = aws_lambda_alias.recipe_generator_live.name
   principal     = "apigateway.amazonaws.com"
   source_arn    = "${aws_api_gateway_rest_api.recipe_api.execution_arn}/*/*"
 }
@@ -283,11 +528,14 @@ resource "aws_api_gateway_deployment" "recipe_api" {
 
   rest_api_id = aws_api_gateway_rest_api.recipe_api.id
 
+  # Hash the full method, integration and request model, not just their ids, so in-place
+  # changes such as pointing the integration uri at the live alias also redeploy the stage
   triggers = {
     redeployment = sha1(jsonencode([
       aws_api_gateway_resource.recipes.id,
-      aws_api_gateway_method.recipes_post.id,
-      aws_api_gateway_integration.recipes_post.id,
+      aws_api_gateway_method.recipes_post,
+      aws_api_gateway_integration.recipes_post,
+      aws_api_gateway_model.recipe_request.schema,
     ]))
   }
 
@@ -22,3 +22,13 @@ output "cloudwatch_dashboard_url" {
   description = "URL of the CloudWatch dashboard"
   value       = "https://${var.aws_region}.console.aws.amazon.com/cloudwatch/home?region=${var.aws_region}#dashboards:name=${aws_cloudwatch_dashboard.recipe_api.dashboard_name}"
 }
+
+output "recipes_table_name" {
+  description = "Name of the DynamoDB table storing generated recipes"
+  value       = aws_dynamodb_table.recipes.name
+}
+
+output "recipe_saves_dlq_url" {
+  description = "URL of the dead-letter queue for failed recipe saves"
+  value       = aws_sqs_queue.recipe_saves_dlq.url
+}
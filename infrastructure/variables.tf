@@ -26,3 +26,21 @@ variable "certificate_arn" {
   type        = string
   default     = null
 }
+
+variable "bedrock_model_id" {
+  description = "Amazon Bedrock model or inference profile ID used for recipe generation"
+  type        = string
+  default     = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
+}
+
+variable "bedrock_latency_optimized" {
+  description = "Use Bedrock latency-optimized inference (disable in regions/models that do not support it)"
+  type        = bool
+  default     = true
+}
+
+variable "warmer_concurrency" {
+  description = "Number of execution environments the scheduled warmer keeps warm"
+  type        = number
+  default     = 1
+}
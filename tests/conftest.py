@@ -0,0 +1,90 @@
+"""
+Shared fixtures for the generate-recipe Lambda tests.
+"""
+
+import os
+import sys
+
+import orjson
+import pytest
+
+# Configure the environment before the Lambda module is imported
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('POWERTOOLS_TRACE_DISABLED', 'true')
+os.environ.setdefault('POWERTOOLS_METRICS_NAMESPACE', 'RecipeAITests')
+os.environ.setdefault('DYNAMODB_TABLE_NAME', 'test-recipes')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'generate-recipe'))
+
+import lambda_function  # noqa: E402
+
+
+class FakeBedrock:
+    """Stands in for the bedrock-runtime client, streaming canned completions."""
+    
+    def __init__(self):
+        self.completions = []
+        self.requests = []
+    
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.requests.append(orjson.loads(kwargs['body']))
+        text, stop_reason = self.completions.pop(0)
+        events = [{'chunk': {'bytes': orjson.dumps({'type': 'message_start'})}}]
+        for start in range(0, len(text), 16):
+            events.append({'chunk': {'bytes': orjson.dumps({
+                'type': 'content_block_delta',
+                'delta': {'type': 'text_delta', 'text': text[start:start + 16]}
+            })}})
+        events.append({'chunk': {'bytes': orjson.dumps({
+            'type': 'message_delta',
+            'delta': {'stop_reason': stop_reason}
+        })}})
+        return {'body': events}
+
+
+class FakeDynamoDB:
+    """Records DynamoDB writes; batch responses can be scripted per call."""
+    
+    def __init__(self):
+        self.batch_responses = []
+        self.batch_requests = []
+        self.put_items = []
+        self.put_error = None
+    
+    def batch_write_item(self, RequestItems):
+        self.batch_requests.append(RequestItems)
+        response = self.batch_responses.pop(0) if self.batch_responses else {}
+        if isinstance(response, Exception):
+            raise response
+        return response
+    
+    def put_item(self, TableName, Item):
+        if isinstance(self.put_error, Exception):
+            raise self.put_error
+        self.put_items.append(Item)
+
+
+class LambdaContext:
+    function_name = 'test-recipe-generator'
+    memory_limit_in_mb = 512
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:test-recipe-generator:live'
+    aws_request_id = 'test-request-id'
+
+
+@pytest.fixture
+def lf(monkeypatch):
+    """The Lambda module with fake AWS clients and empty per-container state."""
+    
+    monkeypatch.setattr(lambda_function, 'bedrock_runtime', FakeBedrock())
+    monkeypatch.setattr(lambda_function, '_dynamodb_client', FakeDynamoDB())
+    monkeypatch.setattr(lambda_function, 'RECIPE_SAVE_QUEUE_URL', None)
+    monkeypatch.setattr(lambda_function.time, 'sleep', lambda seconds: None)
+    lambda_function._recipe_cache.clear()
+    lambda_function._pending_writes.clear()
+    return lambda_function
+
+
+@pytest.fixture
+def context():
+    return LambdaContext()
@@ -0,0 +1,270 @@
+"""
+Tests for the generate-recipe Lambda function.
+"""
+
+import gzip
+import importlib
+from decimal import Decimal
+
+import orjson
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+RECIPE = {
+    'title': 'Egg Fried Rice',
+    'servings': 2,
+    'difficulty': 'easy',
+    'cuisine': 'chinese',
+    'ingredients': [{'item': 'egg', 'amount': '2'}],
+    'instructions': ['Step 1: Scramble the eggs', 'Step 2: Add the rice'],
+    'nutrition': {'calories': 350.5},
+    'tags': ['quick'],
+    'tips': ['Use day-old rice']
+}
+COMPLETION = "Here is your recipe:\n" + orjson.dumps(RECIPE).decode() + "\n\nEnjoy!"
+
+
+def _request(lf, context, **body):
+    response = lf.lambda_handler({'body': orjson.dumps(body).decode()}, context)
+    return response['statusCode'], orjson.loads(response['body'])
+
+
+def _record(message_id, recipe):
+    return {'messageId': message_id, 'body': orjson.dumps(recipe).decode()}
+
+
+def test_perf_mode_disables_tracer_and_wrappers(monkeypatch):
+    module = importlib.import_module('lambda_function')
+    monkeypatch.setenv('POWERTOOLS_PERF_MODE', 'true')
+
+    def handler(event, context):
+        return event
+
+    try:
+        importlib.reload(module)
+
+        assert module.tracer.disabled
+        assert module._capture_method(handler) is handler
+        assert module._capture_lambda_handler(handler) is handler
+        assert module._log_metrics(handler) is handler
+    finally:
+        monkeypatch.delenv('POWERTOOLS_PERF_MODE')
+        importlib.reload(module)
+
+
+def test_stamp_recipe_appends_metadata(lf):
+    stamped = lf._stamp_recipe(orjson.dumps(RECIPE), 'abc123', '2024-01-01T00:00:00+00:00')
+
+    assert orjson.loads(stamped) == {**RECIPE, 'id': 'abc123', 'created_at': '2024-01-01T00:00:00+00:00'}
+
+
+def test_parsed_and_fallback_recipes_carry_no_identity(lf):
+    for recipe in (lf._parse_recipe_response(COMPLETION), lf._create_fallback_recipe('not json')):
+        assert 'id' not in recipe
+        assert 'created_at' not in recipe
+
+
+def test_generate_returns_recipe_and_saves_it(lf, context):
+    lf.bedrock_runtime.completions.append((COMPLETION, 'end_turn'))
+
+    status, recipe = _request(lf, context, ingredients=['rice', 'egg', 'rice'])
+
+    assert status == 200
+    assert recipe['title'] == 'Egg Fried Rice'
+    assert recipe['source'] == 'ai_generated'
+    assert len(recipe['id']) == 32
+
+    # Duplicates are dropped and the caller's order is kept in the prompt
+    prompt = lf.bedrock_runtime.requests[0]['messages'][0]['content']
+    assert prompt.startswith("Generate a detailed recipe using the following ingredients: rice, egg\n")
+
+    item = lf._dynamodb_client.put_items[0]
+    assert item['id'] == {'S': recipe['id']}
+    assert item['nutrition'] == {'M': {'calories': {'N': '350.5'}}}
+    assert orjson.loads(gzip.decompress(item['compressed_body']['B']))['tips'] == RECIPE['tips']
+
+
+def test_identical_requests_are_served_from_cache(lf, context):
+    lf.bedrock_runtime.completions.append((COMPLETION, 'end_turn'))
+
+    _, first = _request(lf, context, ingredients=['egg', 'rice'], save_to_db=False)
+    _, second = _request(lf, context, ingredients=['rice', 'egg'], save_to_db=False)
+
+    assert len(lf.bedrock_runtime.requests) == 1
+    assert first['id'] != second['id']
+    assert first['title'] == second['title']
+
+
+def test_fallback_recipes_are_not_cached(lf, context):
+    lf.bedrock_runtime.completions.append(('{"title": "Egg', 'end_turn'))
+    lf.bedrock_runtime.completions.append((COMPLETION, 'end_turn'))
+
+    _, fallback = _request(lf, context, ingredients=['egg'], save_to_db=False)
+    _, recipe = _request(lf, context, ingredients=['egg'], save_to_db=False)
+
+    assert fallback['source'] == 'ai_fallback'
+    assert recipe['title'] == 'Egg Fried Rice'
+
+
+def test_unencodable_integers_become_fallback_recipe(lf, context):
+    lf.bedrock_runtime.completions.append(('{"title": "Egg", "servings": 99999999999999999999999}', 'end_turn'))
+
+    status, recipe = _request(lf, context, ingredients=['egg'], save_to_db=False)
+
+    assert status == 200
+    assert recipe['source'] == 'ai_fallback'
+    assert lf._recipe_cache == {}
+
+
+def test_default_budget_is_used_without_retry(lf, context):
+    lf.bedrock_runtime.completions.append(('{"title": "Egg', 'max_tokens'))
+
+    status, response = _request(lf, context, ingredients=['egg'], save_to_db=False)
+
+    assert status == 422
+    assert f'budget of {lf._DEFAULT_MAX_TOKENS}' in response['error']
+    assert [r['max_tokens'] for r in lf.bedrock_runtime.requests] == [lf._DEFAULT_MAX_TOKENS]
+
+
+def test_truncated_completion_with_caller_budget_is_rejected(lf, context):
+    lf.bedrock_runtime.completions.append(('{"title": "Egg', 'max_tokens'))
+
+    status, response = _request(lf, context, ingredients=['egg'], max_tokens=100, save_to_db=False)
+
+    assert status == 422
+    assert 'budget of 100' in response['error']
+    assert len(lf.bedrock_runtime.requests) == 1
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'ingredients': []},
+    {'ingredients': None},
+    {'ingredients': 'egg'},
+    {'ingredients': [1]},
+    {'ingredients': ['egg'] * 11},
+    {'ingredients': ['x' * 101]},
+    {'ingredients': ['egg'], 'dietary_restrictions': ['vegan'] * 11},
+    {'ingredients': ['egg'], 'dietary_restrictions': ['x' * 51]},
+    {'ingredients': ['egg'], 'cuisine_type': 'x' * 51},
+    {'ingredients': ['egg'], 'meal_type': 'x' * 51},
+    {'ingredients': ['egg'], 'difficulty': 'x' * 51},
+    {'ingredients': ['egg'], 'cuisine_type': ['italian']},
+    {'ingredients': ['egg'], 'dietary_restrictions': [['vegan']]},
+    {'ingredients': ['egg'], 'difficulty': 3},
+    {'ingredients': ['egg'], 'max_tokens': 0},
+    {'ingredients': ['egg'], 'max_tokens': '500'},
+])
+def test_invalid_requests_are_rejected(lf, context, body):
+    status, response = _request(lf, context, **body)
+
+    assert status == 400
+    assert 'error' in response
+    assert lf.bedrock_runtime.requests == []
+
+
+def test_null_fields_take_their_defaults(lf, context):
+    lf.bedrock_runtime.completions.append((COMPLETION, 'end_turn'))
+
+    status, _ = _request(
+        lf, context, ingredients=['egg'], dietary_restrictions=None, cuisine_type=None,
+        meal_type=None, difficulty=None, max_tokens=None, save_to_db=None
+    )
+
+    assert status == 200
+    request = lf.bedrock_runtime.requests[0]
+    assert "- Difficulty level: medium\n" in request['messages'][0]['content']
+    assert request['max_tokens'] == lf._DEFAULT_MAX_TOKENS
+    assert len(lf._dynamodb_client.put_items) == 1
+
+
+def test_warmer_fans_out_and_skips_bedrock(lf, context, monkeypatch):
+    invocations = []
+
+    class FakeLambda:
+        def invoke(self, **kwargs):
+            invocations.append(kwargs)
+
+    monkeypatch.setattr(lf, '_lambda_client', FakeLambda())
+
+    response = lf.lambda_handler({'source': 'warmer', 'concurrency': 3}, context)
+
+    assert response == {'statusCode': 200, 'body': 'warm'}
+    assert len(invocations) == 2
+    assert invocations[0]['FunctionName'] == context.invoked_function_arn
+    assert invocations[0]['InvocationType'] == 'RequestResponse'
+    assert orjson.loads(invocations[0]['Payload']) == {
+        'source': 'warmer', 'concurrency': 1, 'hold_ms': lf._WARMER_HOLD_MS
+    }
+    assert lf.bedrock_runtime.requests == []
+
+
+def test_fanned_out_warmer_ping_holds_its_environment(lf, context, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(lf.time, 'sleep', sleeps.append)
+
+    response = lf.lambda_handler({'source': 'warmer', 'concurrency': 1, 'hold_ms': 100}, context)
+
+    assert response == {'statusCode': 200, 'body': 'warm'}
+    assert sleeps == [0.1]
+
+
+def test_flush_retries_unprocessed_items_in_chunks(lf):
+    for i in range(30):
+        lf._pending_writes.append((f'm{i}', lf._to_item({**RECIPE, 'id': f'r{i}'})))
+    unprocessed = {lf.DYNAMODB_TABLE_NAME: [{'PutRequest': {'Item': lf._pending_writes[0][1]}}]}
+    lf._dynamodb_client.batch_responses = [{'UnprocessedItems': unprocessed}, {}, {}]
+
+    assert lf._flush() == []
+
+    sizes = [len(request[lf.DYNAMODB_TABLE_NAME]) for request in lf._dynamodb_client.batch_requests]
+    assert sizes == [25, 1, 5]
+    assert lf._pending_writes == []
+
+
+def test_flush_reports_items_left_unprocessed(lf):
+    lf._pending_writes.append(('m0', lf._to_item({**RECIPE, 'id': 'r0'})))
+    unprocessed = {lf.DYNAMODB_TABLE_NAME: [{'PutRequest': {'Item': lf._pending_writes[0][1]}}]}
+    lf._dynamodb_client.batch_responses = [{'UnprocessedItems': unprocessed}] * lf._BATCH_WRITE_MAX_ATTEMPTS
+
+    assert lf._flush() == ['m0']
+
+
+def test_flush_isolates_items_when_batch_is_rejected(lf):
+    lf._pending_writes.append(('m0', lf._to_item({**RECIPE, 'id': 'r0'})))
+    lf._pending_writes.append(('m1', lf._to_item({**RECIPE, 'id': 'r1'})))
+    error = ClientError({'Error': {'Code': 'ValidationException', 'Message': 'bad item'}}, 'BatchWriteItem')
+    lf._dynamodb_client.batch_responses = [error]
+
+    assert lf._flush() == []
+    assert [item['id']['S'] for item in lf._dynamodb_client.put_items] == ['r0', 'r1']
+
+
+def test_flush_reports_items_on_connection_errors(lf):
+    lf._pending_writes.append(('m0', lf._to_item({**RECIPE, 'id': 'r0'})))
+    error = EndpointConnectionError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com')
+    lf._dynamodb_client.batch_responses = [error]
+    lf._dynamodb_client.put_error = error
+
+    assert lf._flush() == ['m0']
+
+
+def test_batch_save_handler_reports_failed_records(lf, context):
+    event = {'Records': [
+        _record('good', {**RECIPE, 'id': 'r0'}),
+        {'messageId': 'not-json', 'body': '{"title": '},
+        _record('no-id', RECIPE)
+    ]}
+
+    response = lf.batch_save_handler(event, context)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'not-json'}, {'itemIdentifier': 'no-id'}]}
+    written = lf._dynamodb_client.batch_requests[0][lf.DYNAMODB_TABLE_NAME]
+    assert [request['PutRequest']['Item']['id']['S'] for request in written] == ['r0']
+
+
+def test_to_item_converts_floats_to_decimal(lf):
+    assert lf._floats_to_decimal({'a': [1.5, {'b': 2.25}], 'c': 3}) == {
+        'a': [Decimal('1.5'), {'b': Decimal('2.25')}],
+        'c': 3
+    }